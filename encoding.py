@@ -1,4 +1,5 @@
 import numpy as np
+from functools import lru_cache
 from typing import Union
 
 
@@ -7,6 +8,23 @@ from typing import Union
 StateVector = Union[np.ndarray, list[float], list[complex]]
 
 
+@lru_cache(maxsize=None)
+def patch_perms(d:int)->tuple:
+
+    '''
+    Computes, once per dimensionality, the axis permutations used to split a signal into patches and to merge them back.
+    Params:
+    - d (int): Dimensionality of the signal.
+    Returns:
+    - patch_perm (tuple): Permutation taking (P_0,S_0,P_1,S_1,...) to (P_0,P_1,...,S_0,S_1,...), e.g. (0,2,4,1,3,5).
+    - depatch_perm (tuple): Inverse permutation, e.g. (0,3,1,4,2,5).
+    '''
+
+    patch_perm = tuple(range(0,2*d,2)) + tuple(range(1,2*d,2))
+    depatch_perm = tuple(int(x) for x in np.argsort(patch_perm))
+    return patch_perm, depatch_perm
+
+
 def patchify(signal, patch_shape=None):
 
     """
@@ -34,10 +52,8 @@ def patchify(signal, patch_shape=None):
         temp_shapes = zip(num_patch_ax,patch_shape) 
         temp_shapes = np.array(list(temp_shapes)).flatten() #(P_0,S_0,P_1,S_1,...)
 
-        og_order = np.arange(0,2*d) #(0,1,2,3,...)
-        new_order = np.array(list(zip(np.arange(0,d),np.arange(d,2*d)))).flatten() #(0,3,1,4,2,5)
-        patches = np.moveaxis(signal.reshape(temp_shapes),og_order,new_order) #(P_0,P_1,...,S_0,S_1,...)
-        print(patches.shape)
+        perm, _ = patch_perms(d) #(0,2,4,1,3,5)
+        patches = signal.reshape(temp_shapes).transpose(perm) #(P_0,P_1,...,S_0,S_1,...)
         patches = patches.reshape(-1,*patch_shape)
     
     return patches
@@ -75,9 +91,11 @@ def depatchify(patches,out_shape):
         num_patch_ax = signal_shape//patch_shape
         d = len(out_shape)
         depatched_array = patches.reshape(*num_patch_ax,*patch_shape)
-        new_order = np.arange(0,2*d) #(0,1,2,3,...)
-        og_order = np.array(list(zip(np.arange(0,d),np.arange(d,2*d)))).flatten() #(0,3,1,4,2,5)
-        depatched_array = np.moveaxis(depatched_array,new_order,og_order).reshape(*out_shape)
+        _, perm = patch_perms(d) #(0,3,1,4,2,5), inverse of the patchify permutation
+        depatched_array = depatched_array.transpose(perm) #(P_0,S_0,P_1,S_1,...)
+        if not depatched_array.flags['C_CONTIGUOUS']: #e.g. 1D signals are already laid out in output order
+            depatched_array = np.ascontiguousarray(depatched_array) #Single relayout pass, so that the reshape below is a view
+        depatched_array = depatched_array.reshape(*out_shape)
      return depatched_array
 
 
@@ -117,21 +135,19 @@ def encode(signal, patch_shape=None):
 
     if len(axes)==len(patches.shape):
         norms = np.sum(patches)
-        with np.errstate(divide='ignore', invalid='ignore'):
-            tmp = patches/norms
-            tmp[np.isinf(tmp)] = 0  # norm 0 implies all entries are 0, so it's 0/0
+        norms_b = norms
 
     
     else:
         #norms = np.sum(patches,axis=axes).reshape(patches.shape[0],*(2*(1,)))
         norms = np.sum(patches,axis=axes)
-        with np.errstate(divide='ignore', invalid='ignore'):
-            tmp = patches/norms[:,*(d*(None,))]
-            tmp[np.isinf(tmp)] = 0  # norm 0 implies all entries are 0, so it's 0/0
+        norms_b = norms[:,*(d*(None,))] #Broadcastable against the patches
     
+    mask = norms_b != 0 # norm 0 implies all entries are 0, so they are left at 0
+    states = np.zeros(patches.shape, dtype=np.result_type(patches, 1.0))
+    np.divide(patches, norms_b, out=states, where=mask)
     
-
-    states = np.sqrt(tmp)
+    np.sqrt(states, out=states)
     
 
 
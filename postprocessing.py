@@ -1,30 +1,70 @@
-from collections import Counter
 import numpy as np
-from multiprocessing import Pool
-from functools import partial
 from qiskit import transpile
 from qiskit_aer import AerSimulator
 
             
-def get_freqs (res, n_outcomes):
+def get_freqs (res, n_outcomes, counts=None):
     '''
     Converts raw measurements results into empirical occurence frequencies for each of the possible outcomes.
 
     Params:
-    - res (iterable): array of raw measurement data;
-    - n_outcomes(int): size of outcome space.
+    - res (iterable): array of raw measurement data, or of the distinct measured outcomes if counts is given;
+    - n_outcomes(int): size of outcome space;
+    - counts (iterable, optional): number of occurences of each of the outcomes in res.
 
     Returns:
     - freqs(numpy array): occurence frequencies from given measurements.
     '''
-    freqs = np.zeros((2**n_outcomes))
-    counts = Counter(res)
-    for k in counts.keys():
-        freqs [k] = counts[k]/len(res)
+    res = np.asarray(res, dtype=np.int64)
+    weights = None if counts is None else np.asarray(counts, dtype=np.float64)
+    freqs = np.bincount(res, weights=weights, minlength=2**n_outcomes).astype(np.float64) #C-level histogram of the outcomes
+    freqs /= res.size if weights is None else weights.sum()
     return freqs
 
 
-def run_circ(qc,S:int,seed:int=None)->np.ndarray:
+def get_outcomes(counts:dict)->tuple:
+    '''
+    Converts measurement counts, keyed by bitstring, into integer outcomes and their number of occurences.
+
+    Params:
+    - counts (dict): measured bitstrings (all of the same length, single classical register) and their occurences.
+
+    Returns:
+    - outcomes(numpy array): integer value of each of the measured bitstrings;
+    - occurences(numpy array): number of occurences of each outcome.
+
+    Raises:
+    - ValueError: if the bitstrings span more than one classical register.
+    '''
+    keys = list(counts.keys())
+    if any(' ' in k for k in keys):
+        raise ValueError('Bitstrings spanning multiple classical registers are not supported')
+    bits = np.frombuffer(''.join(keys).encode(), dtype=np.uint8).reshape(len(keys), -1) - ord('0') #(K, n_clbits) array of 0/1 digits
+    weights = 1 << np.arange(bits.shape[1]-1, -1, -1, dtype=np.int64) #Most significant bit first
+    outcomes = bits.astype(np.int64) @ weights
+    occurences = np.fromiter(counts.values(), dtype=np.int64, count=len(keys))
+    return outcomes, occurences
+
+
+def get_simulator(num_qubits:int)->AerSimulator:
+
+    """
+    Instantiates a statevector simulator, running on GPU (with batched shots) whenever Aer reports one as available.
+
+    Params:
+    - num_qubits (int): Largest number of qubits of the circuits to be simulated.
+
+    Returns:
+    - AerSimulator: The configured simulator.
+    """
+
+    device = 'GPU' if 'GPU' in AerSimulator().available_devices() else 'CPU'
+    simulator = AerSimulator(method='statevector', device=device,
+                             batched_shots_gpu=True, batched_shots_gpu_max_qubits=num_qubits) #Batched options are ignored on CPU
+    return simulator
+
+
+def run_circ(qc,S:int,seed:int=None,simulator=None)->np.ndarray:
 
     """
     Simulates the execution of a quantum circuit and returns the frequency of measurement outcomes.
@@ -33,33 +73,56 @@ def run_circ(qc,S:int,seed:int=None)->np.ndarray:
     - qc (QuantumCircuit): The quantum circuit to be executed.
     - S (int): Number of shots, i.e., the number of repetitions of the experiment.
     - seed (int, optional): Random seed for reproducibility of the simulation results.
+    - simulator (AerSimulator, optional): Simulator the circuit has already been transpiled for. If None, a new simulator
+    is instantiated and the circuit is transpiled for it.
 
     Returns:
     - np.ndarray: An array containing the relative frequencies of each possible measurement outcome.
     """
     
     backend_options = {"seed_simulator": seed} if seed is not None else {} #Optional: set seed for simulations
-    simulator = AerSimulator() #Instantiate simulator
-    
-    qc = transpile(qc, simulator) #Transpile circuit
+    if simulator is None:
+        simulator = get_simulator(qc.num_qubits) #Instantiate simulator
+        qc = transpile(qc, simulator) #Transpile circuit
 
-    job = simulator.run(circuits=qc, shots = S, run_options=backend_options,memory=True) #Run simulation, collect raw measurement outcomes
-    outcomes = [int( m,2) for m in job.result().get_memory()] #Convert measurment outcomes (bitstrings) into integers
+    job = simulator.run(qc, shots = S, **backend_options) #Run simulation, collect measurement counts
+    outcomes, occurences = get_outcomes(job.result().get_counts()) #Convert measurment outcomes (bitstrings) into integers
     
-    out_freqs = get_freqs(outcomes,qc.num_clbits)
+    out_freqs = get_freqs(outcomes,qc.num_clbits,counts=occurences)
        
 
     return out_freqs
 
 
-def patch_run_circ(qcs,S:int,seed:int=None,num_workers=4):
+def patch_run_circ(qcs,S:int,seed:int=None,simulator=None):
+
+    """
+    Simulates the execution of several quantum circuits (one per patch) in a single batched simulator job.
+
+    Params:
+    - qcs (list of QuantumCircuit): The quantum circuits to be executed.
+    - S (int): Number of shots per circuit.
+    - seed (int, optional): Random seed for reproducibility of the simulation results. Aer derives a distinct seed for each
+    circuit of the batch from it, so the patches are sampled independently of each other.
+    - simulator (AerSimulator, optional): Simulator the circuits have already been transpiled for. If None, a new simulator
+    is instantiated and the circuits are transpiled for it.
 
-    partial_run_circ = partial(run_circ, S=S,seed=seed)
+    Returns:
+    - np.ndarray: Relative frequencies of the measurement outcomes, stacked into an (N_circuits, 2**n_outcomes) array.
+    """
 
-    with Pool(processes=num_workers) as pool:
-        results = pool.map(partial_run_circ, qcs)
+    backend_options = {"seed_simulator": seed} if seed is not None else {} #Optional: set seed for simulations
+    if simulator is None:
+        simulator = get_simulator(max(qc.num_qubits for qc in qcs)) #Instantiate simulator
+        qcs = transpile(qcs, simulator) #Transpile all circuits at once
+
+    result = simulator.run(qcs, shots = S, max_parallel_experiments=len(qcs), **backend_options).result() #Single job for all the patches, simulated in parallel, one seed per experiment
+    results = []
+    for i, qc in enumerate(qcs):
+        outcomes, occurences = get_outcomes(result.get_counts(i))
+        results.append(get_freqs(outcomes, qc.num_clbits, counts=occurences))
 
-    return results
+    return np.stack(results, axis=0)
 
 
 def vec2sig(d,freqs,norm):
@@ -80,31 +143,30 @@ def vec2sig(d,freqs,norm):
     
     out_values = freqs *norm
     
-    out_sig = out_values.reshape(d*(int(np.power(len(freqs),1.0/d)),))
+    side = round(len(freqs) ** (1.0/d)) #Side length of the hypercubic output; rounding avoids float truncation errors
+    out_sig = out_values.reshape(d*(side,))
 
     return out_sig
 
 
-def patch_vec2sig(d,patch_freqs,norms, num_workers=4):
+def patch_vec2sig(d,patch_freqs,norms):
     """
     Reconstructs a signal from the measurement results of multiple quantum circuits,
-    each corresponding to a signal patch, using parallel processing.
+    each corresponding to a signal patch, processing all the patches at once.
 
     Params:
-    - patch_freqs (list of np.ndarray): List of frequency results from quantum circuits.
+    - patch_freqs (np.ndarray): Frequency results from quantum circuits, one row per patch.
     - d (int): Dimensionality of the original signal.
     - norm (np.ndarray): Normalization factors for each patch.
-    - num_workers (int, optional): Number of worker processes for parallel execution.
 
     Returns:
-    - np.ndarray: Reconstructed signal patches in parallel.
+    - np.ndarray: Reconstructed signal patches, stacked along the first axis.
     """
     
-    data = [(d, patch, norm) for patch, norm in zip(patch_freqs, norms)]
-
-    # Parallel execution
-    with Pool(processes=num_workers) as pool:
-        out_patches = pool.starmap(vec2sig, data)
+    patch_freqs = np.asarray(patch_freqs) #(N, 2**n_outcomes)
+    side = round(patch_freqs.shape[1] ** (1.0/d))
 
-    return np.array(out_patches)
+    out_values = patch_freqs * np.asarray(norms).reshape(-1,1) #Rescale each patch by its own norm
+    out_patches = out_values.reshape(patch_freqs.shape[0], *(d*(side,)))
 
+    return out_patches
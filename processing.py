@@ -1,6 +1,9 @@
 import numpy as np
+from functools import lru_cache
 from qiskit import QuantumRegister, ClassicalRegister, QuantumCircuit
-from qiskit.circuit.library import QFT
+from qiskit.circuit import Instruction
+from qiskit.circuit.library import QFT, UnitaryGate
+from qiskit_aer.library import SetStatevector
 from encoding import StateVector,get_numQubits
 
 
@@ -8,6 +11,8 @@ from encoding import StateVector,get_numQubits
 
 Circuit = QuantumCircuit #Usefull alias
 
+MAX_UNITARY_QUBITS = 6 #Largest QFT stored as a dense unitary: beyond it, applying the 4**n matrix costs more than the gate sequence
+
 
 
 
@@ -15,7 +20,57 @@ Circuit = QuantumCircuit #Usefull alias
 
 #=#=#= Circuits #=#=#=
 
-def MD_QFT(size:int, circuit,nSub:int ,d:int, inverse:bool = False)->None:
+def state_prep(state:StateVector, num_qubits:int)->SetStatevector:
+
+    '''
+    Builds the simulator instruction writing the encoded state directly into the register, without synthesizing
+    a state preparation circuit. The state is zero-padded on the most significant qubits if the register is larger.
+    Params:
+    - state (StateVector): Normalized quantum state encoding the input signal.
+    - num_qubits (int): Size of the register the state is written into.
+    Returns:
+    - SetStatevector: Instruction to be applied to the whole register.
+    Raises:
+    - ValueError: If the state is all-zero, i.e.: it encodes a zero-norm (patch of the) signal.
+    '''
+
+    if not np.any(state):
+        raise ValueError('Cannot prepare an all-zero state: the signal (or one of its patches) has zero norm')
+
+    if len(state) == 2**num_qubits:
+        full_state = np.asarray(state, dtype=complex) #No padding needed: single conversion pass
+    else:
+        full_state = np.zeros(2**num_qubits, dtype=complex)
+        full_state[:len(state)] = state #Extra qubits start in |0>
+    return SetStatevector(full_state) #Acts on the whole register
+
+
+@lru_cache(maxsize=32)
+def qft_gate(num_qubits:int, inverse:bool = False)->Instruction:
+
+    '''
+    Builds, once per size and direction, the (exact, with swaps) Quantum Fourier Transform gate to be shared by all circuits.
+    Up to MAX_UNITARY_QUBITS qubits, the gate is the DFT matrix itself, so no QFT gate sequence has to be synthesized.
+    Params:
+    - num_qubits (int): Number of qubits the QFT acts on.
+    - inverse (bool): Whether to build the inverse QFT.
+    Returns:
+    - Instruction: The (inverse) QFT, as a UnitaryGate up to MAX_UNITARY_QUBITS qubits.
+    '''
+
+    label = 'iQFT' if inverse  else 'QFT' #Either QFT or Inverse
+
+    if num_qubits > MAX_UNITARY_QUBITS:
+        return QFT(num_qubits=num_qubits, approximation_degree=0, do_swaps=True,
+                   inverse=inverse, insert_barriers=True, name = label).to_instruction()
+
+    N = 2**num_qubits
+    k = np.arange(N)
+    F = np.exp(2j*np.pi*np.outer(k,k)/N)/np.sqrt(N) #F_jk = w^(jk)/sqrt(N), w = exp(2*pi*i/N)
+    return UnitaryGate(F.conj() if inverse else F, label = label) #The DFT matrix is symmetric: its inverse is its conjugate
+
+
+def MD_QFT(size:int, circuit,nSub:int ,d:int, inverse:bool = False, qubits=None)->None:
     
     '''
     Implements a multidimensional Quantum Fourier Transform (MD-QFT) on a multipartite quantum register.
@@ -25,17 +80,17 @@ def MD_QFT(size:int, circuit,nSub:int ,d:int, inverse:bool = False)->None:
     - nSub (int): Number of qubits per subregister.
     - d (int): Number of subregisters.
     - inverse (bool): Whether to apply the inverse QFT.
+    - qubits (list, optional): Circuit qubits in logical order, i.e.: the i-th entry plays the role of the i-th qubit
+    of the multipartite register. Default is the circuit's own qubit order.
     Returns:
     - None: The MD-QFT is applied directly to the circuit.
     '''
 
-    label = 'iQFT' if inverse  else 'QFT' #Either QFT or Inverse
-
-    std_QFT = QFT(num_qubits=size, approximation_degree=0, do_swaps=True,
-               inverse=inverse, insert_barriers=True, name = label) # Standard, i.e.: one-dimensional, QFT
+    std_QFT = qft_gate(size, inverse) # Standard, i.e.: one-dimensional, QFT
+    qubits = circuit.qubits if qubits is None else qubits
 
     for i in range(d):
-        circuit.append(std_QFT,qargs= range(i*nSub,(i*nSub+size)))
+        circuit.append(std_QFT,qargs= qubits[i*nSub:(i*nSub+size)])
 
     return None
     
@@ -60,16 +115,14 @@ def QuDownsample(state: StateVector,nTilde:int,Hadamard:bool = True)->Circuit:
     c = ClassicalRegister(nDown)
     qc = QuantumCircuit(q,c)
     
-    qc.initialize(state)
+    qc.append(state_prep(state,nEnc),q)
     if Hadamard:
         qc.h(q)
         qc.barrier()
     
-    QFT_Enc = QFT(num_qubits=nEnc, approximation_degree=0, do_swaps=True,
-               inverse=False, insert_barriers=True,name = 'QFT')
+    QFT_Enc = qft_gate(nEnc, inverse=False)
     
-    QFT__Down_dagg = QFT(num_qubits = nDown, approximation_degree = 0, do_swaps = True,
-                  inverse = True, insert_barriers = True, name = 'QFT-inverse')
+    QFT__Down_dagg = qft_gate(nDown, inverse=True)
     
     qc.append(QFT_Enc,qargs=q)
     qc.append(QFT__Down_dagg,qargs=q[0:nDown])
@@ -100,16 +153,14 @@ def QuDownsample_2D(state,nTilde:int,Hadamard:bool = True)->Circuit:
     c = ClassicalRegister(nDown)
     qc = QuantumCircuit(q,c)
     
-    qc.initialize(state)
+    qc.append(state_prep(state,nEnc),q)
     if Hadamard:
         qc.h(q)
         qc.barrier()
     
-    QFT_Enc= QFT(num_qubits=nEnc//2, approximation_degree=0, do_swaps=True,
-               inverse=False, insert_barriers=True,name = 'QFT')
+    QFT_Enc= qft_gate(nEnc//2, inverse=False)
     
-    QFT_dagg_Down = QFT(num_qubits = nDown//2, approximation_degree = 0, do_swaps = True,
-                  inverse = True, insert_barriers = True, name = 'iQFT')
+    QFT_dagg_Down = qft_gate(nDown//2, inverse=True)
     
     qc.append(QFT_Enc,qargs= range(0,nEnc//2))
     qc.append(QFT_Enc,qargs= range(nEnc//2,nEnc)) #MD-QFT on encoding register 
@@ -147,7 +198,7 @@ def QuDownsample_MD(state,d:int,nTilde:int,Hadamard:bool=True)->Circuit:
     q = QuantumRegister(nEnc)
     c = ClassicalRegister(nDown)
     qc = QuantumCircuit(q,c)    
-    qc.initialize(state)
+    qc.append(state_prep(state,nEnc),q)
 
     if Hadamard:
         qc.h(q)
@@ -196,24 +247,23 @@ def QUpsample_MD(state,d:int,nTilde:int)->Circuit:
 
     
 
-    qc.initialize(state,qubits=q[0:nEnc])
+    qc.append(state_prep(state,nUp),q) #Padding qubits start in |0>
 
     qc.h(q)
 
     MD_QFT(size = nEnc//d, circuit=qc,nSub=n0, d=d,inverse = False)   
 
     qc.barrier()
+    layout = list(q) #Logical-to-physical qubit map: routing the padding qubits is a relabelling, not a computation
     for i in range((d-1)*nTilde):
         padd_Idx = i//nTilde +1   #Padding Index: determines which subregister the currently selected qubit has to pad
         for j in range(n0*(d-padd_Idx)):
-            qc.swap(q[nEnc+i-j],q[nEnc+i-j-1])
+            layout[nEnc+i-j], layout[nEnc+i-j-1] = layout[nEnc+i-j-1], layout[nEnc+i-j]
 
-    qc.barrier()
-
-    MD_QFT(size = nUp//d, circuit=qc,nSub=n1, d=d, inverse = True)   
+    MD_QFT(size = nUp//d, circuit=qc,nSub=n1, d=d, inverse = True, qubits=layout)   
 
     qc.h(q)
-    qc.measure(q,c)
+    qc.measure(layout,c)
 
     return qc 
             
@@ -237,7 +287,17 @@ def multipatch_circs(patches,circ_builder,params)->list:
     
     '''
     N = patches.shape[0] #Num of pathces
-    patch_circ = [circ_builder(patches[i], *params) for i in range(0,N) ] #Generate a circuit for each of the patches
+    template = circ_builder(patches[0], *params) #All patches share the same geometry: build the full circuit (QFTs included) once
+    prep_idx = next((i for i, inst in enumerate(template.data) if inst.operation.name == 'set_statevector'), None) #Locate the state preparation
+
+    if prep_idx is None: #Builder does not prepare its state via state_prep: no template to reuse, build every circuit
+        return [template] + [circ_builder(patches[i], *params) for i in range(1,N)]
+
+    patch_circ = [template]
+    for i in range(1,N):
+        qc = template.copy()
+        qc.data[prep_idx] = qc.data[prep_idx].replace(operation=state_prep(patches[i],template.num_qubits)) #Only the encoded state changes between patches
+        patch_circ.append(qc)
     return patch_circ
 
 
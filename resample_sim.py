@@ -1,6 +1,8 @@
+import numpy as np
 from encoding import encode, depatchify,get_numQubits
 from processing import circuit_builder, QuDownsample, QuDownsample_2D, QuDownsample_MD, QUpsample_MD
 from postprocessing import *
+from qiskit import transpile
 
 # Dictionary of available circuits
 circuit_library = {
@@ -19,6 +21,7 @@ class Resampling_Sim:
     - norms (np.ndarray): Normalization factors.
     - task (str): The chosen quantum processing task.
     - circuits (list of QuantumCircuit): Generated quantum circuits for simulation.
+    - transpiled (list of QuantumCircuit): Circuits transpiled for the simulator, cached across runs.
     - logbook (dict): Stores information about the simulation (e.g., shots, frequencies).
     """
 
@@ -39,6 +42,9 @@ class Resampling_Sim:
         self._task = task
         self._isPatched = self._patch_shape is not None and self._patch_shape != self._states.shape
         self._circuits = circuit_builder(self._states, circuit_type=circuit_library[self._task], params=params, patches=self._isPatched)
+        num_qubits = max(qc.num_qubits for qc in self._circuits) if self._isPatched else self._circuits.num_qubits
+        self._simulator = get_simulator(num_qubits) #Statevector simulator, on GPU when available
+        self._transpiled = transpile(self._circuits, self._simulator) #Transpiled once, reused by every run
         self._logbook = {'task': self._task, 'patches': self._isPatched}
 
     @property
@@ -71,30 +77,19 @@ class Resampling_Sim:
         - seed (int, optional): Random seed for reproducibility.
 
         Updates:
-        - logbook['frequencies']: Updates the frequencies with new measurements.
+        - logbook['frequencies']: Updates the frequencies with new measurements, as an (N_patches, 2**nOut) array
+        (N_patches = 1 if the signal is not patched).
         - logbook['shots']: Increases the total number of shots.
         """
-        if self._isPatched and 'shots' in self._logbook:
-            new = [f*shots for f in  patch_run_circ(self._circuits, S=shots, seed=seed)]
-            old = [f*self._logbook['shots'] for f in self._logbook['frequencies']]
-            self._logbook['frequencies'] = [(x+y)/(self._logbook['shots'] + shots) for x,y in zip(new,old)]
-            self._logbook['shots'] += shots
-
-        elif not self._isPatched and 'shots' in self._logbook:
-            new = run_circ(self._circuits, S=shots, seed=seed)
-            old = self._logbook['frequencies']
-            self._logbook['frequencies'] = (old * self._logbook['shots'] + new * shots) / (self._logbook['shots'] + shots)
-            self._logbook['shots'] += shots
-
-        elif self._isPatched and 'shots' not in self._logbook:
-            new = patch_run_circ(self._circuits, S=shots, seed=seed)
-            self._logbook['frequencies'] = new
-            self._logbook['shots'] = shots
-
+        if self._isPatched:
+            new = patch_run_circ(self._transpiled, S=shots, seed=seed, simulator=self._simulator) #(N_patches, 2**nOut)
         else:
-            new = run_circ(self._circuits, S=shots, seed=seed)
-            self._logbook['frequencies'] = new
-            self._logbook['shots'] = shots
+            new = np.atleast_2d(run_circ(self._transpiled, S=shots, seed=seed, simulator=self._simulator)) #(1, 2**nOut)
+
+        old_shots = self._logbook.get('shots', 0) #No prior shots: the update below reduces to the new frequencies
+        old = self._logbook.get('frequencies', new)
+        self._logbook['frequencies'] = (old * old_shots + new * shots) / (old_shots + shots)
+        self._logbook['shots'] = old_shots + shots
 
         print('Simulation completed.')
         return True
@@ -113,13 +108,14 @@ class Resampling_Sim:
             raise Exception('No signal to reconstruct.')
 
         if self._isPatched:
-            d = len(self._logbook['frequencies'][0].shape)
+            d = 1 #Frequencies are flat per patch: patches are reconstructed (and merged back) as 1D arrays
             out_sig = patch_vec2sig(d=d, patch_freqs = self._logbook['frequencies'],norms=self._norms)
             shape = tuple(out_sig.shape[0]*x for x in out_sig.shape[1:])
 
         else:
-            d = len(self._logbook['frequencies'].shape)
-            out_sig = vec2sig(d=d, freqs=self._logbook['frequencies'], norm=self._norms)
+            freqs = self._logbook['frequencies'][0] #Single circuit: drop the patches axis
+            d = len(freqs.shape)
+            out_sig = vec2sig(d=d, freqs=freqs, norm=self._norms)
             shape = out_sig.shape
             
         